@@ -7,21 +7,35 @@ Outputs JSON metadata to stdout and PNG files to the output directory.
 
 Usage:
     python generate_maps.py --input <path> --output-dir <path> --maps depth,normals,edges,faceMask,handsMask
+    python generate_maps.py --input-glob '<dir>/*.png' --output-dir <path> --maps depth,normals
+    python generate_maps.py --serve   # JSONL: one job per stdin line, one result per stdout line
 
 Dependencies:
     pip install opencv-python-headless numpy mediapipe
 
+For faster normal maps (optional):
+    pip install numba
+
 For depth estimation (optional but recommended):
     pip install torch torchvision
     # Then install depth-anything-v2 from: https://github.com/DepthAnything/Depth-Anything-V2
+
+For TensorRT-accelerated depth on NVIDIA GPUs (optional):
+    pip install tensorrt onnx
+    # The FP16 engine is built on first use and cached under ~/.cache/depth_anything_v2/trt_engines
 """
 
 import argparse
+import atexit
+import glob
 import json
 import os
 import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
+from typing import Optional
 
 import cv2
 import numpy as np
@@ -31,10 +45,15 @@ import numpy as np
 # ─────────────────────────────────────────────────────────────────────────────
 
 DEPTH_AVAILABLE = False
+TRT_AVAILABLE = False
 MEDIAPIPE_AVAILABLE = False
+NUMBA_AVAILABLE = False
 
 try:
     import torch
+    import torch.nn.functional as F
+    # Let any remaining FP32 matmuls use TF32 tensor cores
+    torch.set_float32_matmul_precision('high')
     # Check if Depth Anything V2 is available
     try:
         from depth_anything_v2.dpt import DepthAnythingV2
@@ -50,35 +69,127 @@ try:
 except ImportError:
     pass
 
+try:
+    import tensorrt as trt
+    TRT_AVAILABLE = True
+except ImportError:
+    pass
+
 try:
     import mediapipe as mp
     MEDIAPIPE_AVAILABLE = True
 except ImportError:
     pass
 
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    pass
+
+# OpenCV transparent API: operations on cv2.UMat run on an OpenCL device when
+# one is present. Set PSYVIS_UMAT=0 to keep everything on the CPU.
+USE_UMAT = cv2.ocl.haveOpenCL() and os.environ.get('PSYVIS_UMAT', '1') == '1'
+cv2.ocl.setUseOpenCL(USE_UMAT)
+
+
+def _to_umat(array: np.ndarray):
+    """Wrap an array for OpenCL-backed OpenCV calls when the T-API is enabled."""
+    return cv2.UMat(array) if USE_UMAT else array
+
+
+def _from_umat(array) -> np.ndarray:
+    """Bring a (possibly UMat) OpenCV result back to a NumPy array."""
+    return array.get() if isinstance(array, cv2.UMat) else array
+
+
+def _reuse_buffer(buffer: Optional[np.ndarray], shape: tuple, dtype) -> np.ndarray:
+    """Return buffer if it has this shape and dtype, otherwise a new array.
+
+    Scratch caches keep only their latest buffer, so a long-running --serve
+    worker holds one per cache however many image sizes it has seen.
+    """
+    if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+        return np.empty(shape, dtype)
+    return buffer
+
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Depth Map Generation
 # ─────────────────────────────────────────────────────────────────────────────
 
-def compute_depth_map_ml(image: np.ndarray, model_size: str = 'vits') -> np.ndarray:
-    """Generate depth map using Depth Anything V2."""
-    if not DEPTH_AVAILABLE:
-        raise RuntimeError("Depth Anything V2 not installed. Run setup_maps_env.sh first.")
+DEPTH_MODEL_CONFIGS = {
+    'vits': {'encoder': 'vits', 'features': 64, 'out_channels': [48, 96, 192, 384]},
+    'vitb': {'encoder': 'vitb', 'features': 128, 'out_channels': [96, 192, 384, 768]},
+    'vitl': {'encoder': 'vitl', 'features': 256, 'out_channels': [256, 512, 1024, 1024]},
+}
 
-    device = 'cuda' if torch.cuda.is_available() else 'mps' if torch.backends.mps.is_available() else 'cpu'
+# Fixed network input (multiple of the ViT patch size 14), shared by the
+# TensorRT engine and batched PyTorch inference
+DEPTH_INPUT_SIZE = 518
+DEPTH_BATCH_SIZE = 8
+TRT_CACHE_DIR = Path.home() / '.cache' / 'depth_anything_v2' / 'trt_engines'
 
-    model_configs = {
-        'vits': {'encoder': 'vits', 'features': 64, 'out_channels': [48, 96, 192, 384]},
-        'vitb': {'encoder': 'vitb', 'features': 128, 'out_channels': [96, 192, 384, 768]},
-        'vitl': {'encoder': 'vitl', 'features': 256, 'out_channels': [256, 512, 1024, 1024]},
-    }
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+# Loaded PyTorch models, keyed by (model_size, device)
+_MODEL_CACHE: dict = {}
+
+# Pinned host input buffers and copy stream for CUDA inference, created on first use
+_DEPTH_STAGING = None
+
+# Deserialized engines plus their pinned host / device buffers, keyed by model size.
+# None records an engine that failed to build or load, so it is not retried.
+_TRT_ENGINES: dict = {}
 
-    if model_size not in model_configs:
-        model_size = 'vits'
 
-    model = DepthAnythingV2(**model_configs[model_size])
+def _select_device() -> str:
+    return 'cuda' if torch.cuda.is_available() else 'mps' if torch.backends.mps.is_available() else 'cpu'
 
+
+def _normalize_depth_input(resized: np.ndarray) -> np.ndarray:
+    """Normalize a resized RGB uint8 image to a (3, H, W) float32 network input."""
+    normalized = (resized.astype(np.float32) / 255.0 - IMAGENET_MEAN) / IMAGENET_STD
+    return normalized.transpose(2, 0, 1)
+
+
+def _aspect_input_size(h: int, w: int) -> tuple[int, int]:
+    """Return the (height, width) DepthAnythingV2.infer_image feeds the network.
+
+    Both sides are at least DEPTH_INPUT_SIZE, the aspect ratio is kept and each
+    side is rounded to a multiple of the patch size 14.
+    """
+    scale = max(DEPTH_INPUT_SIZE / h, DEPTH_INPUT_SIZE / w)
+
+    def constrain(x: float) -> int:
+        y = int(np.round(x / 14) * 14)
+        return y if y >= DEPTH_INPUT_SIZE else int(np.ceil(x / 14) * 14)
+
+    return constrain(h * scale), constrain(w * scale)
+
+
+def _letterbox_region(h: int, w: int) -> tuple[int, int, int, int]:
+    """Return (top, left, height, width) of an h x w image letterboxed into the square input."""
+    scale = DEPTH_INPUT_SIZE / max(h, w)
+    rh, rw = max(1, round(h * scale)), max(1, round(w * scale))
+    return (DEPTH_INPUT_SIZE - rh) // 2, (DEPTH_INPUT_SIZE - rw) // 2, rh, rw
+
+
+def _prepare_depth_input(rgb_image: np.ndarray, out: np.ndarray) -> None:
+    """Letterbox an RGB image into out, a (3, S, S) float32 network input.
+
+    The aspect ratio is kept so inputs of any shape still stack into one batch;
+    the padding is zero, i.e. the ImageNet mean after normalization.
+    """
+    top, left, rh, rw = _letterbox_region(*rgb_image.shape[:2])
+    resized = cv2.resize(rgb_image, (rw, rh), interpolation=cv2.INTER_CUBIC)
+    out.fill(0)
+    out[:, top:top + rh, left:left + rw] = _normalize_depth_input(resized)
+
+
+def _find_depth_checkpoint(model_size: str):
+    """Return the first existing checkpoint path for a model size, or None."""
     # Look for checkpoint in multiple locations
     script_dir = Path(__file__).parent
     checkpoint_paths = [
@@ -87,75 +198,440 @@ def compute_depth_map_ml(image: np.ndarray, model_size: str = 'vits') -> np.ndar
         Path.home() / '.cache' / 'depth_anything_v2' / f'depth_anything_v2_{model_size}.pth',
     ]
 
-    checkpoint_path = None
     for cp in checkpoint_paths:
         if cp.exists():
-            checkpoint_path = cp
-            break
+            return cp
+    return None
+
+
+def _build_depth_model(model_size: str, device: str):
+    """Construct Depth Anything V2 and load its checkpoint onto the device."""
+    model = DepthAnythingV2(**DEPTH_MODEL_CONFIGS[model_size])
 
+    checkpoint_path = _find_depth_checkpoint(model_size)
     if checkpoint_path:
-        model.load_state_dict(torch.load(str(checkpoint_path), map_location='cpu'))
+        try:
+            # mmap pages the checkpoint in instead of reading it into a second host
+            # buffer; assign adopts the loaded tensors rather than copying them
+            state_dict = torch.load(str(checkpoint_path), map_location=device, weights_only=True, mmap=True)
+            model.load_state_dict(state_dict, assign=True)
+        except TypeError:
+            # torch < 2.1 knows neither keyword
+            model.load_state_dict(torch.load(str(checkpoint_path), map_location=device, weights_only=True))
     else:
         print(f"Warning: No checkpoint found for {model_size}. Using uninitialized weights.", file=sys.stderr)
 
-    model = model.to(device).eval()
+    return model.to(device).eval()
+
+
+def _get_depth_model(model_size: str, device: str):
+    """Return the process-wide Depth Anything V2 model, loading it on first use."""
+    key = (model_size, device)
+    if key not in _MODEL_CACHE:
+        _MODEL_CACHE[key] = _build_depth_model(model_size, device)
+    return _MODEL_CACHE[key]
+
+
+def _build_trt_engine(model_size: str, plan_path: Path, logger) -> None:
+    """Export the PyTorch model to ONNX and build a serialized FP16 TensorRT plan."""
+    model = _build_depth_model(model_size, 'cuda')
+    # Per-process temporary names, so concurrent workers never see partial files
+    onnx_path = plan_path.with_name(f'{plan_path.stem}.{os.getpid()}.onnx')
+    tmp_plan_path = plan_path.with_name(f'{plan_path.name}.{os.getpid()}.tmp')
+
+    try:
+        dummy = torch.randn(1, 3, DEPTH_INPUT_SIZE, DEPTH_INPUT_SIZE, device='cuda')
+        with torch.no_grad():
+            torch.onnx.export(
+                model, dummy, str(onnx_path),
+                input_names=['image'], output_names=['depth'],
+                opset_version=17, dynamic_axes=None,
+            )
+
+        builder = trt.Builder(logger)
+        network = builder.create_network(1 << int(trt.NetworkDefinitionCreationFlag.EXPLICIT_BATCH))
+        parser = trt.OnnxParser(network, logger)
+        if not parser.parse(onnx_path.read_bytes()):
+            errors = '; '.join(str(parser.get_error(i)) for i in range(parser.num_errors))
+            raise RuntimeError(f"TensorRT could not parse ONNX export: {errors}")
+
+        config = builder.create_builder_config()
+        config.set_flag(trt.BuilderFlag.FP16)
+        serialized = builder.build_serialized_network(network, config)
+        if serialized is None:
+            raise RuntimeError("TensorRT engine build failed")
+
+        tmp_plan_path.write_bytes(serialized)
+        os.replace(tmp_plan_path, plan_path)
+    finally:
+        onnx_path.unlink(missing_ok=True)
+        tmp_plan_path.unlink(missing_ok=True)
+
+
+def _trt_plan_path(model_size: str) -> Path:
+    """Return the cached plan path for a model size on the current GPU.
+
+    Plans are only valid for the GPU, TensorRT version and weights they were
+    built from, so all three are part of the filename; anything else changing
+    simply selects a new plan.
+    """
+    checkpoint_path = _find_depth_checkpoint(model_size)
+    if checkpoint_path is None:
+        # Never bake uninitialized weights into a cached engine
+        raise RuntimeError(f"No checkpoint found for {model_size}; not building a TensorRT engine")
+    stat = checkpoint_path.stat()
+    checkpoint_tag = f'{stat.st_size:x}-{stat.st_mtime_ns:x}'
+
+    gpu_name = torch.cuda.get_device_name(0).replace(' ', '_')
+    return TRT_CACHE_DIR / f'{gpu_name}_{model_size}_{checkpoint_tag}_trt{trt.__version__}_fp16.plan'
+
+
+def _trt_engine_usable(model_size: str) -> bool:
+    """False once the engine for this model size has failed to build or load."""
+    return _TRT_ENGINES.get(model_size, True) is not None
+
+
+def _load_trt_engine(model_size: str) -> dict:
+    """Load (building on first use) the cached TensorRT engine for a model size.
+
+    I/O buffers are allocated once and bound to the execution context. A failure
+    is remembered, so later calls fail fast instead of rebuilding the engine.
+    """
+    if model_size in _TRT_ENGINES:
+        state = _TRT_ENGINES[model_size]
+        if state is None:
+            raise RuntimeError(f"TensorRT engine for {model_size} failed earlier in this process")
+        return state
+
+    try:
+        state = _open_trt_engine(model_size)
+    except Exception:
+        _TRT_ENGINES[model_size] = None
+        raise
+
+    _TRT_ENGINES[model_size] = state
+    return state
+
+
+def _open_trt_engine(model_size: str) -> dict:
+    """Build the plan if it is missing, then deserialize it and bind its buffers."""
+    plan_path = _trt_plan_path(model_size)
+    TRT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+    logger = trt.Logger(trt.Logger.WARNING)
+    built = False
+    if not plan_path.exists():
+        print(f"Building TensorRT engine for {model_size} (first run only)...", file=sys.stderr)
+        _build_trt_engine(model_size, plan_path, logger)
+        built = True
+
+    runtime = trt.Runtime(logger)
+    engine = runtime.deserialize_cuda_engine(plan_path.read_bytes())
+    if engine is None and not built:
+        # A damaged plan would otherwise fail the same way on every run
+        print(f"Warning: Cached TensorRT engine unreadable, rebuilding: {plan_path}", file=sys.stderr)
+        _build_trt_engine(model_size, plan_path, logger)
+        engine = runtime.deserialize_cuda_engine(plan_path.read_bytes())
+    if engine is None:
+        raise RuntimeError(f"Could not deserialize TensorRT engine: {plan_path}")
+    context = engine.create_execution_context()
+
+    names = [engine.get_tensor_name(i) for i in range(engine.num_io_tensors)]
+    input_name = next(n for n in names if engine.get_tensor_mode(n) == trt.TensorIOMode.INPUT)
+    output_name = next(n for n in names if engine.get_tensor_mode(n) == trt.TensorIOMode.OUTPUT)
+    input_shape = tuple(engine.get_tensor_shape(input_name))
+    output_shape = tuple(engine.get_tensor_shape(output_name))
+
+    state = {
+        'runtime': runtime,
+        'engine': engine,
+        'context': context,
+        'stream': torch.cuda.Stream(),
+        'host_input': torch.empty(input_shape, dtype=torch.float32, pin_memory=True),
+        'device_input': torch.empty(input_shape, dtype=torch.float32, device='cuda'),
+        'device_output': torch.empty(output_shape, dtype=torch.float32, device='cuda'),
+        'host_output': torch.empty(output_shape, dtype=torch.float32, pin_memory=True),
+    }
+    context.set_tensor_address(input_name, state['device_input'].data_ptr())
+    context.set_tensor_address(output_name, state['device_output'].data_ptr())
+    return state
+
+
+def _infer_depth_trt(rgb_image: np.ndarray, model_size: str) -> np.ndarray:
+    """Run the TensorRT engine on an RGB image and return raw depth at input resolution."""
+    state = _load_trt_engine(model_size)
+    h, w = rgb_image.shape[:2]
+
+    _prepare_depth_input(rgb_image, state['host_input'].numpy()[0])
+
+    # Async H2D copy, engine execution and D2H copy all queued on a single stream
+    stream = state['stream']
+    with torch.cuda.stream(stream):
+        state['device_input'].copy_(state['host_input'], non_blocking=True)
+        state['context'].execute_async_v3(stream.cuda_stream)
+        state['host_output'].copy_(state['device_output'], non_blocking=True)
+    stream.synchronize()
+
+    depth = state['host_output'].numpy().reshape(DEPTH_INPUT_SIZE, DEPTH_INPUT_SIZE)
+    top, left, rh, rw = _letterbox_region(h, w)
+    return cv2.resize(depth[top:top + rh, left:left + rw], (w, h), interpolation=cv2.INTER_LINEAR)
+
+
+def _get_depth_staging() -> dict:
+    """Return the pinned ping-pong input buffers and copy stream used on CUDA."""
+    global _DEPTH_STAGING
+    if _DEPTH_STAGING is None:
+        shape = (DEPTH_BATCH_SIZE, 3, DEPTH_INPUT_SIZE, DEPTH_INPUT_SIZE)
+        _DEPTH_STAGING = {
+            'buffers': [torch.empty(shape, dtype=torch.float32, pin_memory=True) for _ in range(2)],
+            'stream': torch.cuda.Stream(),
+        }
+    return _DEPTH_STAGING
+
+
+def _stage_depth_batch(rgb_images: list[np.ndarray], device: str, buffer=None, stream=None):
+    """Preprocess images into a host buffer and start copying it to the device.
+
+    Returns the device tensor and, when a copy stream is given, an event that
+    marks the end of the copy.
+    """
+    n = len(rgb_images)
+    host = buffer[:n] if buffer is not None else torch.empty((n, 3, DEPTH_INPUT_SIZE, DEPTH_INPUT_SIZE))
+    host_array = host.numpy()
+    for i, rgb_image in enumerate(rgb_images):
+        _prepare_depth_input(rgb_image, host_array[i])
+
+    if stream is None:
+        return host.to(device), None
+
+    with torch.cuda.stream(stream):
+        tensor = host.to(device, non_blocking=True)
+        ready = torch.cuda.Event()
+        ready.record(stream)
+    return tensor, ready
+
+
+def _depth_to_uint8(depth, h: int, w: int) -> np.ndarray:
+    """Resize a raw depth prediction to h x w and normalize it to uint8 on its device."""
+    depth = F.interpolate(depth[None, None], (h, w), mode='bilinear', align_corners=True)[0, 0]
+
+    # Normalize to 0-255 (closer = brighter) on the device, copying back only uint8
+    depth = (depth - depth.min()) / (depth.max() - depth.min() + 1e-8) * 255
+    return depth.to(torch.uint8).cpu().numpy()
+
+
+def _infer_depth_torch(rgb_images: list[np.ndarray], model_size: str, device: str) -> list[np.ndarray]:
+    """Run the PyTorch model over RGB images in batches and return uint8 depth maps.
+
+    A single image keeps its aspect ratio, sized as DepthAnythingV2.infer_image
+    would. Batches are letterboxed to one square shape; on CUDA they go through
+    two pinned host buffers on a dedicated copy stream, so uploading batch N+1
+    overlaps the forward pass of batch N.
+    """
+    model = _get_depth_model(model_size, device)
+    autocast = torch.autocast(device_type='cuda', dtype=torch.float16, enabled=(device == 'cuda'))
+
+    if len(rgb_images) == 1:
+        # No batch shape to share and nothing to overlap, so no letterbox or staging
+        rgb_image = rgb_images[0]
+        h, w = rgb_image.shape[:2]
+        in_h, in_w = _aspect_input_size(h, w)
+        resized = cv2.resize(rgb_image, (in_w, in_h), interpolation=cv2.INTER_CUBIC)
+        tensor = torch.from_numpy(np.ascontiguousarray(_normalize_depth_input(resized)))[None].to(device)
+        # Shapes follow each aspect ratio, so cuDNN autotuning would never be reused
+        with torch.inference_mode(), autocast, torch.backends.cudnn.flags(enabled=True, benchmark=False):
+            return [_depth_to_uint8(model(tensor)[0].float(), h, w)]
+
+    chunks = [rgb_images[i:i + DEPTH_BATCH_SIZE] for i in range(0, len(rgb_images), DEPTH_BATCH_SIZE)]
+    staging = _get_depth_staging() if device == 'cuda' else None
+
+    def stage(k: int):
+        if staging is None:
+            return _stage_depth_batch(chunks[k], device)
+        return _stage_depth_batch(chunks[k], device, staging['buffers'][k % 2], staging['stream'])
+
+    depths = []
+    # Every batch has the same letterboxed shape, so let cuDNN autotune its
+    # convolution kernels once and reuse them
+    with torch.inference_mode(), autocast, torch.backends.cudnn.flags(enabled=True, benchmark=True):
+        staged = stage(0)
+        for k, chunk in enumerate(chunks):
+            tensor, ready = staged
+            if ready is not None:
+                compute_stream = torch.cuda.current_stream()
+                compute_stream.wait_event(ready)
+                tensor.record_stream(compute_stream)
+            batch_depth = model(tensor)
+
+            # Preprocess and upload the next chunk while this forward pass runs.
+            # Its buffer was last read by chunk k - 1, whose results are already on the host.
+            if k + 1 < len(chunks):
+                staged = stage(k + 1)
+
+            for depth, rgb_image in zip(batch_depth.float(), chunk):
+                # Drop the letterbox padding, then resize back to the source
+                h, w = rgb_image.shape[:2]
+                top, left, rh, rw = _letterbox_region(h, w)
+                depths.append(_depth_to_uint8(depth[top:top + rh, left:left + rw], h, w))
+
+    return depths
+
+
+def compute_depth_map_ml(image: np.ndarray, model_size: str = 'vits',
+                         rgb: Optional[np.ndarray] = None) -> np.ndarray:
+    """Generate depth map using Depth Anything V2.
+
+    Uses a cached TensorRT FP16 engine on CUDA when TensorRT is installed,
+    otherwise runs the PyTorch model. Pass rgb to reuse an existing RGB copy.
+    """
+    if not DEPTH_AVAILABLE:
+        raise RuntimeError("Depth Anything V2 not installed. Run setup_maps_env.sh first.")
+
+    device = _select_device()
+
+    if model_size not in DEPTH_MODEL_CONFIGS:
+        model_size = 'vits'
 
     # Convert BGR to RGB for the model
-    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    rgb_image = rgb if rgb is not None else cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    if TRT_AVAILABLE and device == 'cuda' and _trt_engine_usable(model_size):
+        try:
+            depth = _infer_depth_trt(rgb_image, model_size)
+
+            # Normalize to 0-255 (closer = brighter)
+            return ((depth - depth.min()) / (depth.max() - depth.min() + 1e-8) * 255).astype(np.uint8)
+        except Exception as e:
+            print(f"Warning: TensorRT depth failed ({e}), falling back to PyTorch", file=sys.stderr)
+
+    return _infer_depth_torch([rgb_image], model_size, device)[0]
+
+
+def compute_depth_maps_ml_batch(images: list[np.ndarray], model_size: str = 'vits') -> list[np.ndarray]:
+    """Generate depth maps for several images using batched Depth Anything V2 passes.
+
+    Each image is letterboxed into the square network input so a whole batch
+    runs as one forward pass; predictions are cropped and resized back to each
+    source resolution.
+    """
+    if not DEPTH_AVAILABLE:
+        raise RuntimeError("Depth Anything V2 not installed. Run setup_maps_env.sh first.")
+
+    device = _select_device()
+
+    if model_size not in DEPTH_MODEL_CONFIGS:
+        model_size = 'vits'
+
+    # The TensorRT engine is built for a batch of one and is already fast per image
+    if TRT_AVAILABLE and device == 'cuda' and _trt_engine_usable(model_size):
+        try:
+            _load_trt_engine(model_size)
+        except Exception as e:
+            print(f"Warning: TensorRT depth failed ({e}), falling back to PyTorch", file=sys.stderr)
+        else:
+            return [compute_depth_map_ml(image, model_size) for image in images]
+
+    rgb_images = [cv2.cvtColor(image, cv2.COLOR_BGR2RGB) for image in images]
+    return _infer_depth_torch(rgb_images, model_size, device)
 
-    with torch.no_grad():
-        depth = model.infer_image(rgb_image)
 
-    # Normalize to 0-255 (closer = brighter)
-    depth_normalized = ((depth - depth.min()) / (depth.max() - depth.min() + 1e-8) * 255).astype(np.uint8)
-    return depth_normalized
+# Separable 31x31 Gaussian (sigma 5) the simple depth fallback blurs |Laplacian| with
+SIMPLE_DEPTH_BLUR_KERNEL = cv2.getGaussianKernel(31, 0, cv2.CV_32F)
 
 
-def compute_depth_map_simple(image: np.ndarray) -> np.ndarray:
+def compute_depth_map_simple(image: np.ndarray, gray: Optional[np.ndarray] = None) -> np.ndarray:
     """Simple depth approximation using edge density and blur estimation.
 
     This is a fallback when ML models are not available.
     Not accurate but provides some structural guidance.
     """
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if len(image.shape) == 3 else image
+    if gray is None:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if len(image.shape) == 3 else image
 
-    # Use Laplacian variance as a rough depth cue (sharp = closer)
-    laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-    laplacian_var = cv2.GaussianBlur(np.abs(laplacian).astype(np.float32), (31, 31), 0)
+    # Use Laplacian variance as a rough depth cue (sharp = closer): int16
+    # Laplacian, |x| / 4 in uint8 (|Laplacian| of a uint8 image is at most
+    # 1020, so nothing clips), then the 31x31 Gaussian read from uint8 and
+    # accumulated in FP32; the normalization cancels the scale
+    laplacian = cv2.Laplacian(_to_umat(gray), cv2.CV_16S)
+    laplacian_abs = cv2.convertScaleAbs(laplacian, alpha=0.25)
+    laplacian_var = cv2.sepFilter2D(laplacian_abs, cv2.CV_32F, SIMPLE_DEPTH_BLUR_KERNEL, SIMPLE_DEPTH_BLUR_KERNEL)
 
     # Normalize
-    depth = ((laplacian_var - laplacian_var.min()) / (laplacian_var.max() - laplacian_var.min() + 1e-8) * 255)
-    return depth.astype(np.uint8)
+    depth = cv2.normalize(laplacian_var, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+    return _from_umat(depth)
 
 
-def compute_depth_map(image: np.ndarray) -> tuple[np.ndarray, str]:
+def compute_depth_map(image: np.ndarray, gray: Optional[np.ndarray] = None,
+                      rgb: Optional[np.ndarray] = None) -> tuple[np.ndarray, str]:
     """Generate depth map using best available method."""
     if DEPTH_AVAILABLE:
         try:
-            depth = compute_depth_map_ml(image, 'vits')
+            depth = compute_depth_map_ml(image, 'vits', rgb=rgb)
             return depth, 'depth-anything-v2-vits'
         except Exception as e:
             print(f"Warning: ML depth failed ({e}), falling back to simple method", file=sys.stderr)
 
-    depth = compute_depth_map_simple(image)
+    depth = compute_depth_map_simple(image, gray=gray)
     return depth, 'simple-laplacian'
 
 
+def compute_depth_maps(images: list[np.ndarray]) -> tuple[list[np.ndarray], str]:
+    """Generate depth maps for several images using best available method."""
+    if DEPTH_AVAILABLE:
+        try:
+            depths = compute_depth_maps_ml_batch(images, 'vits')
+            return depths, 'depth-anything-v2-vits'
+        except Exception as e:
+            print(f"Warning: ML depth failed ({e}), falling back to simple method", file=sys.stderr)
+
+    depths = [compute_depth_map_simple(image) for image in images]
+    return depths, 'simple-laplacian'
+
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Normal Map Generation
 # ─────────────────────────────────────────────────────────────────────────────
 
+# Z component of the unnormalized normal (scaled for better visualization)
+NORMALS_Z_SCALE = 0.5
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _normals_kernel(dx, dy, out_bgr, grad_scale, z_scale):
+        """Normalize (-dx, -dy, z) per pixel and write it as BGR uint8.
+
+        dx/dy are the raw int16 Sobel responses; grad_scale maps them to FP32.
+        """
+        h, w = dx.shape
+        for i in prange(h):
+            for j in range(w):
+                nx = -np.float32(dx[i, j]) * grad_scale
+                ny = -np.float32(dy[i, j]) * grad_scale
+                inv = np.float32(1.0) / np.sqrt(nx * nx + ny * ny + z_scale * z_scale + np.float32(1e-16))
+                out_bgr[i, j, 0] = np.uint8((z_scale * inv + 1) * np.float32(127.5))
+                out_bgr[i, j, 1] = np.uint8((ny * inv + 1) * np.float32(127.5))
+                out_bgr[i, j, 2] = np.uint8((nx * inv + 1) * np.float32(127.5))
+
+
 def compute_normals_from_depth(depth: np.ndarray) -> np.ndarray:
     """Compute surface normals from depth map using Sobel gradients."""
-    depth_float = depth.astype(np.float32) / 255.0
+    # Both 3x3 Sobel gradients of the uint8 depth in one int16 pass; dividing
+    # by 255 gives the gradients of depth in [0, 1]
+    dx, dy = cv2.spatialGradient(depth, ksize=3)
+    grad_scale = np.float32(1.0 / 255)
 
-    # Compute gradients
-    dzdx = cv2.Sobel(depth_float, cv2.CV_32F, 1, 0, ksize=3)
-    dzdy = cv2.Sobel(depth_float, cv2.CV_32F, 0, 1, ksize=3)
+    if NUMBA_AVAILABLE:
+        # Fused scale -> normalize -> quantize -> BGR pass; no float intermediates
+        normal_bgr = np.empty(depth.shape[:2] + (3,), np.uint8)
+        _normals_kernel(dx, dy, normal_bgr, grad_scale, np.float32(NORMALS_Z_SCALE))
+        return normal_bgr
+
+    dzdx = dx.astype(np.float32) * grad_scale
+    dzdy = dy.astype(np.float32) * grad_scale
 
     # Compute normal vectors (scale Z component for better visualization)
-    z_scale = 0.5
-    normal = np.dstack((-dzdx, -dzdy, np.ones_like(depth_float) * z_scale))
+    z_scale = NORMALS_Z_SCALE
+    normal = np.dstack((-dzdx, -dzdy, np.full(dzdx.shape, z_scale, np.float32)))
     norm = np.linalg.norm(normal, axis=2, keepdims=True)
     normal = normal / (norm + 1e-8)
 
@@ -171,63 +647,117 @@ def compute_normals_from_depth(depth: np.ndarray) -> np.ndarray:
 # Edge Map Generation
 # ─────────────────────────────────────────────────────────────────────────────
 
-def compute_edges(image: np.ndarray) -> np.ndarray:
+def compute_edges(image: np.ndarray, gray: Optional[np.ndarray] = None) -> np.ndarray:
     """Compute Canny edge map with automatic threshold selection."""
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if len(image.shape) == 3 else image
+    if gray is None:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if len(image.shape) == 3 else image
 
     # Apply slight blur to reduce noise
-    blurred = cv2.GaussianBlur(gray, (3, 3), 0)
+    blurred = cv2.GaussianBlur(_to_umat(gray), (3, 3), 0)
 
-    # Auto threshold based on median
-    median = np.median(blurred)
+    # Auto threshold based on median, read off a 256-bin histogram of the uint8 image
+    hist = _from_umat(cv2.calcHist([blurred], [0], None, [256], [0, 256])).ravel()
+    cumulative = np.cumsum(hist)
+    median = int(np.searchsorted(cumulative, cumulative[-1] * 0.5))
     sigma = 0.33
     low = int(max(0, (1.0 - sigma) * median))
     high = int(min(255, (1.0 + sigma) * median))
 
     edges = cv2.Canny(blurred, low, high)
-    return edges
+    return _from_umat(edges)
 
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Face Mask Generation
 # ─────────────────────────────────────────────────────────────────────────────
 
-def compute_face_mask(image: np.ndarray) -> np.ndarray:
+# Two dilations with a k x k rectangle equal one with a (2k - 1) x (2k - 1)
+# rectangle, so each mask is dilated in a single pass (5x5 twice, 15x15 twice)
+FACE_DILATE_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (9, 9))
+HANDS_DILATE_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (29, 29))
+
+# MediaPipe solvers are expensive to construct, so they are built once per process.
+# The legacy FaceMesh solution is used deliberately: the newer FaceLandmarker
+# task is slower for static images.
+_FACE_MESH = None
+_HANDS = None
+
+
+def _get_face_mesh():
+    global _FACE_MESH
+    if _FACE_MESH is None:
+        _FACE_MESH = mp.solutions.face_mesh.FaceMesh(
+            static_image_mode=True,
+            max_num_faces=10,
+            refine_landmarks=True,
+            min_detection_confidence=0.5
+        )
+    return _FACE_MESH
+
+
+def _get_hands():
+    global _HANDS
+    if _HANDS is None:
+        _HANDS = mp.solutions.hands.Hands(
+            static_image_mode=True,
+            max_num_hands=4,
+            min_detection_confidence=0.5
+        )
+    return _HANDS
+
+
+def _close_mediapipe_solvers() -> None:
+    if _FACE_MESH is not None:
+        _FACE_MESH.close()
+    if _HANDS is not None:
+        _HANDS.close()
+
+
+atexit.register(_close_mediapipe_solvers)
+
+
+def _landmarks_to_points(landmarks, w: int, h: int) -> np.ndarray:
+    """Convert normalized MediaPipe landmarks to an (N, 2) int32 array of pixel coordinates."""
+    count = len(landmarks)
+    xs = np.fromiter((lm.x for lm in landmarks), dtype=np.float64, count=count)
+    ys = np.fromiter((lm.y for lm in landmarks), dtype=np.float64, count=count)
+    return np.stack([(xs * w).astype(np.int32), (ys * h).astype(np.int32)], axis=1)
+
+
+# Per-thread BGR -> RGB scratch: the mask generators run concurrently, so each
+# worker thread converts into its own buffer
+_RGB_SCRATCH = threading.local()
+
+
+def _to_rgb(image: np.ndarray) -> np.ndarray:
+    """Convert BGR to RGB into a reused buffer (valid until the thread's next call)."""
+    rgb = _RGB_SCRATCH.buffer = _reuse_buffer(getattr(_RGB_SCRATCH, 'buffer', None), image.shape, image.dtype)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=rgb)
+
+
+def compute_face_mask(image: np.ndarray, rgb: Optional[np.ndarray] = None) -> np.ndarray:
     """Generate face region mask using MediaPipe Face Mesh."""
     if not MEDIAPIPE_AVAILABLE:
         raise RuntimeError("MediaPipe not installed. Run: pip install mediapipe")
 
-    mp_face_mesh = mp.solutions.face_mesh
     mask = np.zeros(image.shape[:2], dtype=np.uint8)
 
-    with mp_face_mesh.FaceMesh(
-        static_image_mode=True,
-        max_num_faces=10,
-        refine_landmarks=True,
-        min_detection_confidence=0.5
-    ) as face_mesh:
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        results = face_mesh.process(rgb_image)
-
-        if results.multi_face_landmarks:
-            h, w = image.shape[:2]
-            for face_landmarks in results.multi_face_landmarks:
-                # Get all face landmark points
-                points = []
-                for landmark in face_landmarks.landmark:
-                    x = int(landmark.x * w)
-                    y = int(landmark.y * h)
-                    points.append([x, y])
-
-                points = np.array(points, dtype=np.int32)
-
-                # Create convex hull of face landmarks
-                hull = cv2.convexHull(points)
-                cv2.fillConvexPoly(mask, hull, 255)
+    face_mesh = _get_face_mesh()
+    rgb_image = rgb if rgb is not None else _to_rgb(image)
+    results = face_mesh.process(rgb_image)
+
+    if results.multi_face_landmarks:
+        h, w = image.shape[:2]
+        for face_landmarks in results.multi_face_landmarks:
+            # Get all face landmark points
+            points = _landmarks_to_points(face_landmarks.landmark, w, h)
+
+            # Create convex hull of face landmarks
+            hull = cv2.convexHull(points)
+            cv2.fillConvexPoly(mask, hull, 255)
 
     # Dilate slightly to ensure full coverage
-    kernel = np.ones((5, 5), np.uint8)
-    mask = cv2.dilate(mask, kernel, iterations=2)
+    mask = _from_umat(cv2.dilate(_to_umat(mask), FACE_DILATE_KERNEL, iterations=1))
 
     return mask
 
@@ -236,40 +766,28 @@ def compute_face_mask(image: np.ndarray) -> np.ndarray:
 # Hands Mask Generation
 # ─────────────────────────────────────────────────────────────────────────────
 
-def compute_hands_mask(image: np.ndarray) -> np.ndarray:
+def compute_hands_mask(image: np.ndarray, rgb: Optional[np.ndarray] = None) -> np.ndarray:
     """Generate hands region mask using MediaPipe Hands."""
     if not MEDIAPIPE_AVAILABLE:
         raise RuntimeError("MediaPipe not installed. Run: pip install mediapipe")
 
-    mp_hands = mp.solutions.hands
     mask = np.zeros(image.shape[:2], dtype=np.uint8)
 
-    with mp_hands.Hands(
-        static_image_mode=True,
-        max_num_hands=4,
-        min_detection_confidence=0.5
-    ) as hands:
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        results = hands.process(rgb_image)
-
-        if results.multi_hand_landmarks:
-            h, w = image.shape[:2]
-            for hand_landmarks in results.multi_hand_landmarks:
-                points = []
-                for landmark in hand_landmarks.landmark:
-                    x = int(landmark.x * w)
-                    y = int(landmark.y * h)
-                    points.append([x, y])
-
-                points = np.array(points, dtype=np.int32)
-
-                # Create convex hull of hand landmarks
-                hull = cv2.convexHull(points)
-                cv2.fillConvexPoly(mask, hull, 255)
+    hands = _get_hands()
+    rgb_image = rgb if rgb is not None else _to_rgb(image)
+    results = hands.process(rgb_image)
+
+    if results.multi_hand_landmarks:
+        h, w = image.shape[:2]
+        for hand_landmarks in results.multi_hand_landmarks:
+            points = _landmarks_to_points(hand_landmarks.landmark, w, h)
+
+            # Create convex hull of hand landmarks
+            hull = cv2.convexHull(points)
+            cv2.fillConvexPoly(mask, hull, 255)
 
     # Dilate more aggressively to include full hand area
-    kernel = np.ones((15, 15), np.uint8)
-    mask = cv2.dilate(mask, kernel, iterations=2)
+    mask = _from_umat(cv2.dilate(_to_umat(mask), HANDS_DILATE_KERNEL, iterations=1))
 
     return mask
 
@@ -278,12 +796,22 @@ def compute_hands_mask(image: np.ndarray) -> np.ndarray:
 # Segmentation Map Generation
 # ─────────────────────────────────────────────────────────────────────────────
 
+# Longest side GrabCut runs at; the binary result is upsampled to full size
+SEGMENTATION_MAX_DIMENSION = 512
+
+# GrabCut GMM workspaces and label mask, reused across calls
+_GRABCUT_BGD = np.zeros((1, 65), np.float64)
+_GRABCUT_FGD = np.zeros((1, 65), np.float64)
+_GRABCUT_MASK: Optional[np.ndarray] = None
+
+
 def compute_segmentation_mask(image: np.ndarray) -> np.ndarray:
     """Generate a rough foreground/background segmentation mask using GrabCut.
 
     This is a lightweight, dependency-free segmentation fallback.
     White = foreground, Black = background.
     """
+    global _GRABCUT_MASK
     h, w = image.shape[:2]
     if h <= 2 or w <= 2:
         return np.zeros((h, w), dtype=np.uint8)
@@ -291,14 +819,28 @@ def compute_segmentation_mask(image: np.ndarray) -> np.ndarray:
     # Initialize with a central rectangle, leaving a margin.
     margin_x = max(10, int(w * 0.05))
     margin_y = max(10, int(h * 0.05))
-    rect = (margin_x, margin_y, max(1, w - 2 * margin_x), max(1, h - 2 * margin_y))
 
-    mask = np.zeros((h, w), np.uint8)
-    bgdModel = np.zeros((1, 65), np.float64)
-    fgdModel = np.zeros((1, 65), np.float64)
+    # GrabCut cost scales with pixel count; a coarse mask is just as good when
+    # computed on a downscaled copy and upsampled afterwards.
+    scale = min(1.0, SEGMENTATION_MAX_DIMENSION / max(h, w))
+    if scale < 1.0:
+        small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    else:
+        small = image
+    sh, sw = small.shape[:2]
+
+    rect_x, rect_y = int(margin_x * scale), int(margin_y * scale)
+    rect = (rect_x, rect_y, max(1, sw - 2 * rect_x), max(1, sh - 2 * rect_y))
+
+    mask = _GRABCUT_MASK = _reuse_buffer(_GRABCUT_MASK, (sh, sw), np.uint8)
+    mask.fill(0)
+    bgdModel = _GRABCUT_BGD
+    fgdModel = _GRABCUT_FGD
+    bgdModel.fill(0)
+    fgdModel.fill(0)
 
     # Run GrabCut; 3 iterations is usually enough for a coarse mask.
-    cv2.grabCut(image, mask, rect, bgdModel, fgdModel, 3, cv2.GC_INIT_WITH_RECT)
+    cv2.grabCut(small, mask, rect, bgdModel, fgdModel, 3, cv2.GC_INIT_WITH_RECT)
 
     # Convert GrabCut labels to binary mask.
     # 0/2 = background/prob background, 1/3 = foreground/prob foreground
@@ -307,47 +849,100 @@ def compute_segmentation_mask(image: np.ndarray) -> np.ndarray:
 
     # Mild morphology to clean speckle.
     kernel = np.ones((3, 3), np.uint8)
-    out = cv2.morphologyEx(out, cv2.MORPH_OPEN, kernel, iterations=1)
+    out = cv2.morphologyEx(_to_umat(out), cv2.MORPH_OPEN, kernel, iterations=1)
     out = cv2.morphologyEx(out, cv2.MORPH_CLOSE, kernel, iterations=2)
 
-    return out
+    if (sh, sw) != (h, w):
+        out = cv2.resize(out, (w, h), interpolation=cv2.INTER_NEAREST)
+
+    return _from_umat(out)
 
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Main Entry Point
 # ─────────────────────────────────────────────────────────────────────────────
 
-def main():
-    parser = argparse.ArgumentParser(description='Generate control maps for PsyVis Lab')
-    parser.add_argument('--input', required=True, help='Input image path')
-    parser.add_argument('--output-dir', required=True, help='Output directory')
-    parser.add_argument('--maps', default='depth,edges,faceMask,handsMask',
-                        help='Comma-separated list of maps to generate')
-    parser.add_argument('--max-dimension', type=int, default=1024,
-                        help='Maximum dimension for processing')
-    args = parser.parse_args()
-
-    requested_maps = [m.strip() for m in args.maps.split(',')]
-    output_dir = Path(args.output_dir)
-    output_dir.mkdir(parents=True, exist_ok=True)
-
-    # Load image
-    image = cv2.imread(args.input)
+def load_image(path: str, max_dimension: int):
+    """Load an image as BGR, downscaling so its longest side is at most max_dimension."""
+    image = cv2.imread(path)
     if image is None:
-        print(json.dumps({'error': f'Could not load image: {args.input}'}))
-        sys.exit(1)
+        return None
 
     # Resize if needed
     h, w = image.shape[:2]
-    if max(h, w) > args.max_dimension:
-        scale = args.max_dimension / max(h, w)
+    if max(h, w) > max_dimension:
+        scale = max_dimension / max(h, w)
         new_w, new_h = int(w * scale), int(h * scale)
         image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_AREA)
-        h, w = new_h, new_w
+
+    return image
+
+
+# Shared pool for PNG encoding so writes overlap with map computation
+_IO_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix='png-writer')
+
+# Maps computed directly from the input image:
+# kind -> (generator, modelUsed, shared color conversion it accepts)
+IMAGE_MAP_GENERATORS = {
+    'edges': (compute_edges, 'canny-auto', 'gray'),
+    'segmentation': (compute_segmentation_mask, 'opencv-grabcut', None),
+    'faceMask': (compute_face_mask, 'mediapipe-face-mesh', 'rgb'),
+    'handsMask': (compute_hands_mask, 'mediapipe-hands', 'rgb'),
+}
+
+
+def _map_entry(kind: str, image: np.ndarray, model_used: str) -> dict:
+    h, w = image.shape[:2]
+    return {
+        'kind': kind,
+        'filename': f'{kind}.png',
+        'width': w,
+        'height': h,
+        'generatedAt': datetime.now(timezone.utc).isoformat(),
+        'modelUsed': model_used
+    }
+
+
+def _imwrite_checked(path: Path, image: np.ndarray) -> None:
+    # cv2.imwrite reports most failures (e.g. a missing directory) by returning False
+    if not cv2.imwrite(str(path), image):
+        raise RuntimeError(f'Could not write {path}')
+
+
+def _write_png(path: Path, image: np.ndarray) -> Future:
+    """Queue a PNG encode + write on the shared I/O pool; the future raises if it fails."""
+    return _IO_POOL.submit(_imwrite_checked, path, image)
+
+
+def _generate_image_map(kind: str, image: np.ndarray, output_dir: Path,
+                        conversions: dict) -> tuple[dict, Future]:
+    """Compute one map from the input image and queue its PNG write.
+
+    Returns the metadata entry and the pending write.
+    """
+    compute, model_used, conversion = IMAGE_MAP_GENERATORS[kind]
+    output = compute(image, **{conversion: conversions[conversion]}) if conversion else compute(image)
+    write = _write_png(output_dir / f'{kind}.png', output)
+    return _map_entry(kind, image, model_used), write
+
+
+def generate_maps(image: np.ndarray, output_dir: Path, requested_maps: list[str],
+                  depth_result: Optional[tuple[np.ndarray, str]] = None) -> dict:
+    """Generate the requested maps for one image and write them to output_dir.
+
+    Maps computed from the image alone run concurrently on a thread pool
+    (OpenCV, MediaPipe and Torch release the GIL) while depth, and normals
+    derived from it, are computed on the calling thread. PNG encoding happens
+    on a separate I/O pool and is awaited before returning.
+    depth_result may carry a precomputed (depth_map, model_used) pair, e.g. from
+    batched inference, in which case depth is not recomputed.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    h, w = image.shape[:2]
 
     # Save resized input
     input_path = output_dir / 'input.png'
-    cv2.imwrite(str(input_path), image)
+    input_write = _write_png(input_path, image)
 
     results = {
         'maps': [],
@@ -356,91 +951,178 @@ def main():
         'inputFilename': 'input.png'
     }
 
-    depth_map = None
-
-    # Generate requested maps
-    for map_type in requested_maps:
+    # Each map is produced once, however often it is listed
+    requested_maps = list(dict.fromkeys(requested_maps))
+    image_kinds = [m for m in requested_maps if m in IMAGE_MAP_GENERATORS]
+    wants_depth = 'depth' in requested_maps or 'normals' in requested_maps
+    computes_depth = wants_depth and depth_result is None
+
+    # Color conversions shared by every map that needs them (simple depth and
+    # edges take gray, ML depth and the MediaPipe masks take RGB)
+    conversions = {
+        'gray': cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if (computes_depth and not DEPTH_AVAILABLE) or 'edges' in image_kinds else None,
+        'rgb': _to_rgb(image)
+        if (computes_depth and DEPTH_AVAILABLE) or 'faceMask' in image_kinds or 'handsMask' in image_kinds
+        else None,
+    }
+    # kind -> (metadata entry, pending PNG write)
+    pending = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(len(image_kinds), os.cpu_count() or 1))) as pool:
+        futures = {kind: pool.submit(_generate_image_map, kind, image, output_dir, conversions)
+                   for kind in image_kinds}
+
+        # Depth runs once up front, whether depth, normals or both were requested
+        # and in any order. The Numba normals kernel stays on this thread.
+        if wants_depth:
+            try:
+                depth_map, model_used = depth_result or compute_depth_map(image, **conversions)
+                if 'depth' in requested_maps:
+                    pending['depth'] = (_map_entry('depth', image, model_used),
+                                        _write_png(output_dir / 'depth.png', depth_map))
+            except Exception as e:
+                print(f'Warning: Failed to generate depth: {e}', file=sys.stderr)
+                depth_map = None
+
+            if 'normals' in requested_maps and depth_map is not None:
+                try:
+                    normals = compute_normals_from_depth(depth_map)
+                    pending['normals'] = (_map_entry('normals', image, 'sobel-from-depth'),
+                                          _write_png(output_dir / 'normals.png', normals))
+                except Exception as e:
+                    print(f'Warning: Failed to generate normals: {e}', file=sys.stderr)
+
+        for kind, future in futures.items():
+            try:
+                pending[kind] = future.result()
+            except Exception as e:
+                print(f'Warning: Failed to generate {kind}: {e}', file=sys.stderr)
+
+    entries = {}
+    for kind, (entry, write) in pending.items():
         try:
-            if map_type == 'depth':
-                depth_map, model_used = compute_depth_map(image)
-                cv2.imwrite(str(output_dir / 'depth.png'), depth_map)
-                results['maps'].append({
-                    'kind': 'depth',
-                    'filename': 'depth.png',
-                    'width': w,
-                    'height': h,
-                    'generatedAt': datetime.now(timezone.utc).isoformat(),
-                    'modelUsed': model_used
-                })
-
-            elif map_type == 'normals':
-                # Generate depth first if not already done
-                if depth_map is None:
-                    depth_map, _ = compute_depth_map(image)
-                normals = compute_normals_from_depth(depth_map)
-                cv2.imwrite(str(output_dir / 'normals.png'), normals)
-                results['maps'].append({
-                    'kind': 'normals',
-                    'filename': 'normals.png',
-                    'width': w,
-                    'height': h,
-                    'generatedAt': datetime.now(timezone.utc).isoformat(),
-                    'modelUsed': 'sobel-from-depth'
-                })
-
-            elif map_type == 'edges':
-                edges = compute_edges(image)
-                cv2.imwrite(str(output_dir / 'edges.png'), edges)
-                results['maps'].append({
-                    'kind': 'edges',
-                    'filename': 'edges.png',
-                    'width': w,
-                    'height': h,
-                    'generatedAt': datetime.now(timezone.utc).isoformat(),
-                    'modelUsed': 'canny-auto'
-                })
-
-            elif map_type == 'segmentation':
-                seg = compute_segmentation_mask(image)
-                cv2.imwrite(str(output_dir / 'segmentation.png'), seg)
-                results['maps'].append({
-                    'kind': 'segmentation',
-                    'filename': 'segmentation.png',
-                    'width': w,
-                    'height': h,
-                    'generatedAt': datetime.now(timezone.utc).isoformat(),
-                    'modelUsed': 'opencv-grabcut'
-                })
-
-            elif map_type == 'faceMask':
-                face_mask = compute_face_mask(image)
-                cv2.imwrite(str(output_dir / 'faceMask.png'), face_mask)
-                results['maps'].append({
-                    'kind': 'faceMask',
-                    'filename': 'faceMask.png',
-                    'width': w,
-                    'height': h,
-                    'generatedAt': datetime.now(timezone.utc).isoformat(),
-                    'modelUsed': 'mediapipe-face-mesh'
-                })
-
-            elif map_type == 'handsMask':
-                hands_mask = compute_hands_mask(image)
-                cv2.imwrite(str(output_dir / 'handsMask.png'), hands_mask)
-                results['maps'].append({
-                    'kind': 'handsMask',
-                    'filename': 'handsMask.png',
-                    'width': w,
-                    'height': h,
-                    'generatedAt': datetime.now(timezone.utc).isoformat(),
-                    'modelUsed': 'mediapipe-hands'
-                })
+            write.result()
+            entries[kind] = entry
+        except Exception as e:
+            print(f'Warning: Failed to generate {kind}: {e}', file=sys.stderr)
+    # The pack is unusable without its input image, so this failure propagates
+    input_write.result()
+
+    # Report maps in the order they were requested
+    results['maps'] = [entries[kind] for kind in requested_maps if kind in entries]
+    return results
+
 
+def process_job(job: dict) -> dict:
+    """Run one generation job and return its JSON result.
+
+    Job keys mirror the CLI flags: input or inputGlob, outputDir, maps (list or
+    comma-separated string) and maxDimension.
+    """
+    maps = job.get('maps', 'depth,edges,faceMask,handsMask')
+    if isinstance(maps, str):
+        maps = maps.split(',')
+    requested_maps = [m.strip() for m in maps]
+    max_dimension = int(job.get('maxDimension', 1024))
+    output_dir = Path(job['outputDir'])
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    if job.get('inputGlob'):
+        paths = sorted(glob.glob(job['inputGlob']))
+        wants_depth = 'depth' in requested_maps or 'normals' in requested_maps
+
+        # Work through the glob one depth batch at a time, so only that many
+        # images and depth maps are held in memory however large the glob is
+        entries = []
+        for start in range(0, len(paths), DEPTH_BATCH_SIZE):
+            loaded = [(index, path, load_image(path, max_dimension))
+                      for index, path in enumerate(paths[start:start + DEPTH_BATCH_SIZE], start)]
+            images = [(index, image) for index, _, image in loaded if image is not None]
+
+            # Run depth for the whole chunk up front so it batches on the device
+            depth_results = {}
+            if images and wants_depth:
+                depths, model_used = compute_depth_maps([image for _, image in images])
+                depth_results = {index: (depth, model_used) for (index, _), depth in zip(images, depths)}
+
+            for index, path, image in loaded:
+                if image is None:
+                    entries.append({'input': path, 'error': f'Could not load image: {path}'})
+                    continue
+                # Index prefix keeps same-named inputs from different folders apart
+                image_dir = output_dir / f'{index:04d}_{Path(path).stem}'
+                try:
+                    result = generate_maps(image, image_dir, requested_maps, depth_results.get(index))
+                except Exception as e:
+                    entries.append({'input': path, 'error': str(e)})
+                    continue
+                entries.append({'input': path, 'outputDir': str(image_dir), **result})
+
+        return {'images': entries}
+
+    # Load image
+    image = load_image(job['input'], max_dimension)
+    if image is None:
+        return {'error': f'Could not load image: {job["input"]}'}
+
+    return generate_maps(image, output_dir, requested_maps)
+
+
+def serve() -> None:
+    """Answer JSONL jobs from stdin, one JSON result line per job on stdout.
+
+    Models, solvers and scratch buffers stay loaded between jobs. A job's "id",
+    if given, is echoed back so callers can match results to requests.
+    """
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        job = None
+        try:
+            job = json.loads(line)
+            result = process_job(job)
         except Exception as e:
-            print(f'Warning: Failed to generate {map_type}: {e}', file=sys.stderr)
+            result = {'error': f'{type(e).__name__}: {e}'}
+        if isinstance(job, dict) and 'id' in job:
+            result = {'id': job['id'], **result}
+        print(json.dumps(result), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate control maps for PsyVis Lab')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input', help='Input image path')
+    source.add_argument('--input-glob',
+                        help='Glob of input images; each gets its own subdirectory of --output-dir '
+                             'and depth runs as batched inference')
+    source.add_argument('--serve', action='store_true',
+                        help='Stay resident and process one JSON job per stdin line')
+    parser.add_argument('--output-dir', help='Output directory (required unless --serve)')
+    parser.add_argument('--maps', default='depth,edges,faceMask,handsMask',
+                        help='Comma-separated list of maps to generate')
+    parser.add_argument('--max-dimension', type=int, default=1024,
+                        help='Maximum dimension for processing')
+    args = parser.parse_args()
+
+    if args.serve:
+        serve()
+        return
+    if not args.output_dir:
+        parser.error('--output-dir is required')
+
+    results = process_job({
+        'input': args.input,
+        'inputGlob': args.input_glob,
+        'outputDir': args.output_dir,
+        'maps': args.maps,
+        'maxDimension': args.max_dimension,
+    })
 
     # Output JSON result to stdout
     print(json.dumps(results))
+    if 'error' in results:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -61,6 +61,7 @@ pip install --quiet \
     opencv-python-headless \
     numpy \
     pillow \
+    numba \
     mediapipe
 
 echo "  Base dependencies installed."
@@ -146,6 +147,12 @@ print('  ✓ OpenCV:', cv2.__version__)
 print('  ✓ NumPy:', np.__version__)
 print('  ✓ MediaPipe: installed')
 
+try:
+    import numba
+    print('  ✓ Numba:', numba.__version__)
+except ImportError:
+    print('  ⚠ Numba: not installed (slower normal maps)')
+
 try:
     import torch
     print('  ✓ PyTorch:', torch.__version__)